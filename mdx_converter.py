@@ -4,141 +4,312 @@ MDX Converter - Convert MDX files to PDF and/or DOCX formats.
 """
 
 import argparse
+import copy
+import functools
+import hashlib
 import os
 import sys
 import re
-from pathlib import Path
+
+# Imports and JSX/React component tags, stripped from MDX in a single pass.
+# Self-closing components are tried before opening tags so that "<Comp />"
+# is never taken as the start of a block. Tag branches stop at the next '<'
+# or '>', so a '<' that starts no tag only costs the scan up to the next one.
+# The strip phase works on the raw UTF-8 bytes: every delimiter is ASCII,
+# so matches never split a multi-byte character.
+_RE_MDX_TOKEN = re.compile(rb'(?P<imp>import)|<[A-Z][^<>]*/>|(?P<open><[A-Z][^<>]*>)')
+_RE_IMPORT_TAIL = re.compile(rb'[^;\n]*;')
+_RE_JSX_CLOSE = re.compile(rb'</[A-Z][^<>]*>')
+
+def _strip_jsx(data):
+    """Remove imports and JSX/React components from MDX bytes.
+    
+    An import runs to the next ';' on the same line, and a block component
+    from its opening tag to the next closing tag. Imports without a ';' and
+    opening tags with no closing tag after them are left in place.
+    """
+    # Every branch needs one of these substrings, and the substring search
+    # is much cheaper than scanning plain Markdown for tokens
+    if b'<' not in data and b'import' not in data:
+        return data
+    
+    search = _RE_MDX_TOKEN.search
+    parts = []
+    kept = pos = 0
+    # Failed searches are remembered so no byte is scanned twice for the same
+    # terminator: once a closing tag search fails, no later opening tag can be
+    # closed, and an import without a ';' rules out the rest of its line
+    no_close_from = len(data) + 1
+    no_semicolon_until = -1
+    while True:
+        match = search(data, pos)
+        if match is None:
+            break
+        end = match.end()
+        kind = match.lastgroup
+        if kind == 'imp':
+            tail = None
+            if end >= no_semicolon_until:
+                tail = _RE_IMPORT_TAIL.match(data, end)
+                if tail is None:
+                    line_end = data.find(b'\n', end)
+                    no_semicolon_until = len(data) if line_end == -1 else line_end
+            if tail is None:
+                pos = end
+                continue
+            end = tail.end()
+        elif kind == 'open':
+            close = None
+            if end < no_close_from:
+                close = _RE_JSX_CLOSE.search(data, end)
+                if close is None:
+                    no_close_from = end
+            if close is None:
+                pos = end
+                continue
+            end = close.end()
+        parts.append(data[kept:match.start()])
+        kept = pos = end
+    parts.append(data[kept:])
+    return b''.join(parts)
+
+# Leading frontmatter block delimited by '---' lines, with LF or CRLF line endings
+_RE_FRONTMATTER = re.compile(rb'(?s)\A---\r?\n(?:.*?\r?\n)?---(?:\r?\n|\Z)')
+
+def _strip_frontmatter(data):
+    """Remove a leading frontmatter block delimited by '---' lines from MDX bytes."""
+    if data.startswith(b'---'):
+        match = _RE_FRONTMATTER.match(data)
+        if match:
+            return data[match.end():]
+    return data
+
+def _clean_mdx(source):
+    """Strip frontmatter and JSX/React components from raw MDX bytes and decode them."""
+    return _strip_jsx(_strip_frontmatter(source)).decode('utf-8')
+
+# Markdown and PDF engines, built on first use and shared by every file converted
+_MD = None
+_WEASYPRINT = None
+
+# Stylesheet applied to every generated PDF
+_PDF_CSS = """
+body { font-family: Arial, sans-serif; margin: 20px; }
+pre { background-color: #f5f5f5; padding: 10px; border-radius: 5px; }
+code { font-family: monospace; }
+"""
+
+# Document wrapper placed around the rendered Markdown for PDF output
+_HTML_HEAD = '<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"></head>\n<body>\n'
+_HTML_TAIL = '\n</body>\n</html>\n'
+
+def _get_md():
+    """Return the shared MarkdownIt parser."""
+    global _MD
+    if _MD is None:
+        from markdown_it import MarkdownIt
+        _MD = MarkdownIt('commonmark').enable('table').enable('strikethrough')
+    return _MD
+
+@functools.lru_cache(maxsize=4)
+def _parse_markdown(mdx_content):
+    """Tokenize cleaned MDX content, reusing the result for repeated content.
+    
+    process_file hands the same cleaned string to every requested format, so
+    caching a few recent documents is enough for them to share one parse.
+    The returned tokens must not be modified.
+    """
+    return _get_md().parse(mdx_content)
+
+def _render_html(mdx_content):
+    """Render cleaned MDX content to HTML from its (cached) token stream."""
+    md = _get_md()
+    return md.renderer.render(_parse_markdown(mdx_content), md.options, {})
+
+def _get_weasyprint():
+    """Return WeasyPrint's HTML class with the shared PDF stylesheet and font configuration."""
+    global _WEASYPRINT
+    if _WEASYPRINT is None:
+        from weasyprint import CSS, HTML
+        from weasyprint.text.fonts import FontConfiguration
+        font_config = FontConfiguration()
+        _WEASYPRINT = (HTML, CSS(string=_PDF_CSS, font_config=font_config), font_config)
+    return _WEASYPRINT
+
+def _inline_text(token):
+    """Return the plain text of a markdown-it inline token."""
+    children = token.children or ()
+    if len(children) == 1 and children[0].type == 'text':
+        return children[0].content  # unformatted text, the common case
+    parts = []
+    for child in children:
+        if child.type in ('softbreak', 'hardbreak'):
+            parts.append('\n')
+        elif child.type != 'html_inline':
+            parts.append(child.content)
+    return ''.join(parts)
+
+def _paragraph_template(style):
+    """Build a <w:p> with the given paragraph style and one empty text run."""
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+
+    return parse_xml(
+        f'<w:p {nsdecls("w")}><w:pPr><w:pStyle w:val="{style.style_id}"/></w:pPr>'
+        '<w:r><w:t xml:space="preserve"></w:t></w:r></w:p>'
+    )
+
+def _add_tokens_to_docx(doc, tokens):
+    """Append a markdown-it token stream to a python-docx document."""
+    from docx.shared import Pt  # availability is checked by the caller
+
+    add = doc.add_paragraph
+    # Resolve styles once; add_paragraph() looks up styles given by name on every call
+    styles = doc.styles
+    heading_styles = [None] + [styles[f"Heading {i}"] for i in range(1, 7)]
+    quote_style = styles['Quote']
+    table_style = styles['Table Grid']
+    list_styles = {}  # (ordered, depth) -> list item style
+    for ordered, name in ((False, 'List Bullet'), (True, 'List Number')):
+        for depth in (1, 2, 3):
+            list_styles[ordered, depth] = styles[name if depth == 1 else f"{name} {depth}"]
+    # List items are the bulk of most documents, so they are emitted as copies
+    # of a prebuilt <w:p> per style instead of going through add_paragraph()
+    body = doc.element.body
+    insert_p = body.sectPr.addprevious if body.sectPr is not None else body.append
+    list_templates = {}
+    lists = []          # one entry per open list: True if ordered
+    item_marker = None  # marker for the first paragraph of the current list item
+    in_quote = 0
+    rows = None         # cell texts of the table being read
+    text = ''
+    level = 1
+
+    for token in tokens:
+        kind = token.type
+        if kind == 'inline':
+            text = _inline_text(token)
+        elif kind == 'heading_open':
+            level = int(token.tag[1])
+        elif kind == 'heading_close':
+            add(text, style=heading_styles[level])
+        elif kind == 'paragraph_close':
+            if item_marker is not None:
+                key = (lists[-1], min(len(lists), 3))
+                text = item_marker + text
+                if '\n' in text or '\t' in text or '\r' in text:
+                    # add_paragraph() turns line breaks and tabs into <w:br/> and <w:tab/>
+                    add(text, style=list_styles[key])
+                else:
+                    template = list_templates.get(key)
+                    if template is None:
+                        template = list_templates[key] = _paragraph_template(list_styles[key])
+                    p = copy.deepcopy(template)
+                    p[-1][-1].text = text
+                    insert_p(p)
+                item_marker = None
+            elif in_quote:
+                add(text, style=quote_style)
+            else:
+                add(text)
+        elif kind in ('fence', 'code_block'):
+            # Add code blocks with a different style
+            p = add(token.content.rstrip('\n'))
+            for run in p.runs:
+                run.font.name = 'Courier New'
+                run.font.size = Pt(10)
+        elif kind == 'bullet_list_open':
+            lists.append(False)
+        elif kind == 'ordered_list_open':
+            lists.append(True)
+        elif kind in ('bullet_list_close', 'ordered_list_close'):
+            lists.pop()
+        elif kind == 'list_item_open':
+            item_marker = f"{token.info}. " if lists[-1] else '• '
+        elif kind == 'list_item_close':
+            item_marker = None
+        elif kind == 'blockquote_open':
+            in_quote += 1
+        elif kind == 'blockquote_close':
+            in_quote -= 1
+        elif kind == 'table_open':
+            rows = []
+        elif kind == 'tr_open':
+            rows.append([])
+        elif kind in ('th_open', 'td_open'):
+            text = ''
+        elif kind in ('th_close', 'td_close'):
+            rows[-1].append(text)
+        elif kind == 'table_close':
+            table = doc.add_table(rows=len(rows), cols=max(map(len, rows)), style=table_style)
+            for row, cells in zip(table.rows, rows):
+                for cell, cell_text in zip(row.cells, cells):
+                    cell.text = cell_text
+            rows = None
 
 def convert_mdx_to_html(mdx_path):
     """Convert MDX content to HTML."""
     try:
-        with open(mdx_path, 'r', encoding='utf-8') as f:
-            mdx_content = f.read()
+        with open(mdx_path, 'rb') as f:
+            source = f.read()
         
-        # Strip out JSX/React components from MDX (simplified approach)
-        mdx_content = re.sub(r'import.*?;', '', mdx_content)
-        mdx_content = re.sub(r'<[A-Z][^>]*>.*?</[A-Z][^>]*>', '', mdx_content, flags=re.DOTALL)
-        mdx_content = re.sub(r'<[A-Z][^/>]*?/>', '', mdx_content)
+        # Strip out frontmatter and JSX/React components from MDX (simplified approach)
+        mdx_content = _clean_mdx(source)
         
         # Convert Markdown to HTML
         try:
-            from markdown_it import MarkdownIt
+            _get_md()
         except ImportError:
             print("Error: markdown-it-py is required. Install it using 'pip install markdown-it-py'", file=sys.stderr)
             sys.exit(1)
             
-        md = MarkdownIt()
-        html_content = md.render(mdx_content)
+        html_content = _render_html(mdx_content)
         
         return html_content
     except Exception as e:
         print(f"Error converting MDX to HTML: {e}", file=sys.stderr)
         sys.exit(1)
 
-def convert_mdx_to_pdf(mdx_path, output_path):
-    """Convert MDX file to PDF."""
+def convert_mdx_to_pdf(mdx_content, output_path):
+    """Convert cleaned MDX content (see _clean_mdx) to PDF."""
     try:
         try:
-            import markdown2
-            from xhtml2pdf import pisa
-        except ImportError:
-            print("Error: markdown2 and xhtml2pdf are required for PDF conversion.", file=sys.stderr)
-            print("Install them using 'pip install markdown2 xhtml2pdf'", file=sys.stderr)
+            _get_md()
+            HTML, stylesheet, font_config = _get_weasyprint()
+        except (ImportError, OSError):
+            # WeasyPrint raises OSError when its Pango/Cairo libraries are missing
+            print("Error: markdown-it-py and weasyprint are required for PDF conversion.", file=sys.stderr)
+            print("Install them using 'pip install markdown-it-py weasyprint'", file=sys.stderr)
             sys.exit(1)
             
-        # Read and clean MDX content
-        with open(mdx_path, 'r', encoding='utf-8') as f:
-            mdx_content = f.read()
-        
-        # Strip out JSX/React components from MDX
-        mdx_content = re.sub(r'import.*?;', '', mdx_content)
-        mdx_content = re.sub(r'<[A-Z][^>]*>.*?</[A-Z][^>]*>', '', mdx_content, flags=re.DOTALL)
-        mdx_content = re.sub(r'<[A-Z][^/>]*?/>', '', mdx_content)
-        
         # Convert to HTML
-        html_content = markdown2.markdown(mdx_content)
-        
-        # Add basic HTML structure
-        html_document = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 20px; }}
-                pre {{ background-color: #f5f5f5; padding: 10px; border-radius: 5px; }}
-                code {{ font-family: monospace; }}
-            </style>
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
+        html_content = _render_html(mdx_content)
         
         # Convert HTML to PDF
-        with open(output_path, "wb") as pdf_file:
-            pisa_status = pisa.CreatePDF(html_document, dest=pdf_file)
-            
-        if pisa_status.err:
-            print(f"Error converting HTML to PDF: {pisa_status.err}", file=sys.stderr)
-            sys.exit(1)
-            
+        html_document = _HTML_HEAD + html_content + _HTML_TAIL
+        HTML(string=html_document).write_pdf(output_path, stylesheets=[stylesheet],
+                                             font_config=font_config)
+        
         print(f"Created PDF: {output_path}")
     except Exception as e:
         print(f"Error converting to PDF: {e}", file=sys.stderr)
         sys.exit(1)
 
-def convert_mdx_to_docx(mdx_path, output_path):
-    """Convert MDX file to DOCX."""
+def convert_mdx_to_docx(mdx_content, output_path):
+    """Convert cleaned MDX content (see _clean_mdx) to DOCX."""
     try:
         try:
-            import markdown2
+            _get_md()
             from docx import Document
-            from docx.shared import Pt
-            from bs4 import BeautifulSoup
         except ImportError:
-            print("Error: markdown2, python-docx, and beautifulsoup4 are required for DOCX conversion.", file=sys.stderr)
-            print("Install them using 'pip install markdown2 python-docx beautifulsoup4'", file=sys.stderr)
+            print("Error: markdown-it-py and python-docx are required for DOCX conversion.", file=sys.stderr)
+            print("Install them using 'pip install markdown-it-py python-docx'", file=sys.stderr)
             sys.exit(1)
             
-        # Read and clean MDX content
-        with open(mdx_path, 'r', encoding='utf-8') as f:
-            mdx_content = f.read()
-        
-        # Strip out JSX/React components from MDX
-        mdx_content = re.sub(r'import.*?;', '', mdx_content)
-        mdx_content = re.sub(r'<[A-Z][^>]*>.*?</[A-Z][^>]*>', '', mdx_content, flags=re.DOTALL)
-        mdx_content = re.sub(r'<[A-Z][^/>]*?/>', '', mdx_content)
-        
-        # Convert to HTML
-        html_content = markdown2.markdown(mdx_content, extras=['fenced-code-blocks', 'tables'])
-        
-        # Parse HTML
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Create a new Word document
+        # Tokenize the Markdown and build the document straight from the tokens
+        tokens = _parse_markdown(mdx_content)
         doc = Document()
-        
-        # Process HTML elements and add to document
-        for element in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'p', 'pre', 'code', 'ul', 'ol', 'li']):
-            if element.name.startswith('h'):
-                level = int(element.name[1])
-                doc.add_heading(element.text, level=level)
-            elif element.name == 'p':
-                doc.add_paragraph(element.text)
-            elif element.name == 'pre' or element.name == 'code':
-                # Add code blocks with a different style
-                p = doc.add_paragraph(element.text)
-                for run in p.runs:
-                    run.font.name = 'Courier New'
-                    run.font.size = Pt(10)
-            elif element.name == 'ul':
-                for li in element.find_all('li', recursive=False):
-                    doc.add_paragraph('• ' + li.text, style='List Bullet')
-            elif element.name == 'ol':
-                for i, li in enumerate(element.find_all('li', recursive=False), 1):
-                    doc.add_paragraph(f"{i}. {li.text}", style='List Number')
+        _add_tokens_to_docx(doc, tokens)
         
         # Save the document
         doc.save(output_path)
@@ -147,59 +318,155 @@ def convert_mdx_to_docx(mdx_path, output_path):
         print(f"Error converting to DOCX: {e}", file=sys.stderr)
         sys.exit(1)
 
-def process_file(mdx_path, output_dir, formats):
-    """Process a single MDX file according to the requested formats."""
-    filename = mdx_path.stem  # Get filename without extension
+# Output format -> converter taking cleaned MDX content and an output path
+_CONVERTERS = {
+    'pdf': convert_mdx_to_pdf,
+    'docx': convert_mdx_to_docx,
+}
+
+def _is_up_to_date(mdx_path, output_path, digest):
+    """Check whether output_path was generated from MDX content with this digest."""
+    try:
+        if os.path.getmtime(output_path) < os.path.getmtime(mdx_path):
+            return False
+        with open(output_path + '.sha', 'r', encoding='ascii') as f:
+            return f.read().strip() == digest
+    except OSError:
+        return False
+
+def process_file(mdx_path, output_dir, formats, force=False):
+    """Process a single MDX file according to the requested formats.
+    
+    Outputs whose recorded source hash matches the current MDX content are
+    skipped unless force is set.
+    """
+    filename = os.path.splitext(os.path.basename(mdx_path))[0]  # Get filename without extension
+    
+    try:
+        with open(mdx_path, 'rb') as f:
+            source = f.read()
+    except OSError as e:
+        print(f"Error reading '{mdx_path}': {e}", file=sys.stderr)
+        sys.exit(1)
+    digest = hashlib.blake2b(source, digest_size=16).hexdigest()
     
+    cleaned = None
     for fmt in formats:
         output_path = os.path.join(output_dir, f"{filename}.{fmt}")
         
-        if fmt == 'pdf':
-            convert_mdx_to_pdf(mdx_path, output_path)
-        elif fmt == 'docx':
-            convert_mdx_to_docx(mdx_path, output_path)
-
-def process_directory(mdx_dir, output_dir, formats):
-    """Process all MDX files in a directory."""
-    mdx_files = list(Path(mdx_dir).glob('**/*.mdx'))
+        if not force and _is_up_to_date(mdx_path, output_path, digest):
+            print(f"Up to date: {output_path}")
+            continue
+        
+        # Strip out frontmatter and JSX/React components once, shared by every format
+        if cleaned is None:
+            try:
+                cleaned = _clean_mdx(source)
+            except UnicodeDecodeError as e:
+                print(f"Error reading '{mdx_path}': {e}", file=sys.stderr)
+                sys.exit(1)
+        
+        _CONVERTERS[fmt](cleaned, output_path)
+        
+        # Record the source hash next to the output for the next run
+        with open(output_path + '.sha', 'w', encoding='ascii') as f:
+            f.write(digest)
+
+def _iter_mdx_files(root):
+    """Yield the paths of all MDX files under root, recursively.
     
-    if not mdx_files:
-        print(f"No MDX files found in '{mdx_dir}'")
+    Directories that cannot be read are skipped, as Path.glob() does.
+    """
+    try:
+        entries = os.scandir(root)
+    except PermissionError:
         return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_mdx_files(entry.path)
+            elif entry.name.endswith('.mdx'):
+                yield entry.path
+
+def _mirror_output_dir(mdx_file, mdx_dir, output_dir):
+    """Create and return the output directory matching mdx_file's subdirectory of mdx_dir."""
+    subdir = os.path.relpath(os.path.dirname(mdx_file), mdx_dir)
+    if subdir == os.curdir:
+        return output_dir
+    target = os.path.join(output_dir, subdir)
+    os.makedirs(target, exist_ok=True)
+    return target
+
+def process_directory(mdx_dir, output_dir, formats, jobs=None, force=False):
+    """Process all MDX files in a directory, using up to `jobs` worker processes.
+    
+    Outputs keep the subdirectory layout of mdx_dir, so files with the same
+    name in different subdirectories do not overwrite each other.
+    """
+    mdx_files = _iter_mdx_files(mdx_dir)
+    count = 0
+    
+    if jobs == 1:
+        for mdx_file in mdx_files:
+            process_file(mdx_file, _mirror_output_dir(mdx_file, mdx_dir, output_dir),
+                         formats, force)
+            count += 1
+    else:
+        # Files are independent, so convert them in parallel worker processes.
+        # Paths are fed to the pool as the walk finds them, with a bounded
+        # number of conversions in flight.
+        from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+        workers = jobs or os.cpu_count() or 1
+        pending = set()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for mdx_file in mdx_files:
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                file_output_dir = _mirror_output_dir(mdx_file, mdx_dir, output_dir)
+                pending.add(executor.submit(process_file, mdx_file, file_output_dir,
+                                            formats, force))
+                count += 1
+            for future in wait(pending).done:
+                future.result()
     
-    print(f"Found {len(mdx_files)} MDX files to process")
-    for mdx_file in mdx_files:
-        process_file(mdx_file, output_dir, formats)
+    if count:
+        print(f"Processed {count} MDX files")
+    else:
+        print(f"No MDX files found in '{mdx_dir}'")
 
 def main():
     """Main entry point for the script."""
     parser = argparse.ArgumentParser(description='Convert MDX files to PDF and/or DOCX formats.')
     parser.add_argument('input_path', help='Path to MDX file or directory containing MDX files')
     parser.add_argument('output_directory', help='Path to output directory')
-    parser.add_argument('--format', choices=['pdf', 'docx', 'both'], default='both',
+    parser.add_argument('--format', choices=[*_CONVERTERS, 'both'], default='both',
                        help='Output format (default: both)')
+    parser.add_argument('--jobs', type=int, default=None,
+                       help='Number of files to convert in parallel (default: number of CPUs)')
+    parser.add_argument('--force', action='store_true',
+                       help='Regenerate outputs even if the MDX source is unchanged')
     
     args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
     
-    # Convert format to a list of formats
-    formats = []
-    if args.format == 'both':
-        formats = ['pdf', 'docx']
-    else:
-        formats = [args.format]
+    # Convert format to a tuple of formats
+    formats = tuple(_CONVERTERS) if args.format == 'both' else (args.format,)
     
     # Create output directory if it doesn't exist
     os.makedirs(args.output_directory, exist_ok=True)
     
     # Determine if input is a file or directory
-    input_path = Path(args.input_path)
-    if input_path.is_file():
-        if input_path.suffix.lower() != '.mdx':
+    input_path = args.input_path
+    if os.path.isfile(input_path):
+        if os.path.splitext(input_path)[1].lower() != '.mdx':
             print(f"Error: '{input_path}' is not an MDX file.", file=sys.stderr)
             sys.exit(1)
-        process_file(input_path, args.output_directory, formats)
-    elif input_path.is_dir():
-        process_directory(input_path, args.output_directory, formats)
+        process_file(input_path, args.output_directory, formats, args.force)
+    elif os.path.isdir(input_path):
+        process_directory(input_path, args.output_directory, formats, args.jobs, args.force)
     else:
         print(f"Error: '{input_path}' not found or is not a file/directory.", file=sys.stderr)
         sys.exit(1)